@@ -3,77 +3,45 @@ import geemap
 
 # 初始化 GEE
 import os
+import hashlib
 
 # 获取项目 ID，如果没有则使用默认值
 project_id = os.getenv('GCP_PROJECT_ID', 'terrior-hunter')  # Google Cloud 项目 ID
 
-try:
-    ee.Initialize(project=project_id)
-except Exception as e:
-    print(f"初始化失败: {e}")
-    print("请完成以下步骤:")
-    print("1. 访问 https://console.cloud.google.com 创建一个项目")
-    print("2. 设置环境变量: set GCP_PROJECT_ID=your-project-id")
-    print("3. 重新运行脚本")
-    exit(1)
-
-# 1. 定义感兴趣区域 (ROI) - 陕西洛川富士苹果典型产区
-# 洛川县：世界最佳苹果优生区之一，位于陕西省延安市
-# 地理位置：109.4°E, 35.8°N，海拔 800-1200m
-# 搜索范围：以洛川为中心，半径约 50km 的周边地区
-roi = ee.Geometry.Point([109.4, 35.8]).buffer(50000).bounds()  # 50km 半径
-
-print("✓ ROI 已设置为陕西洛川富士苹果产区及周边")
-print("  中心位置: 洛川县 (109.4°E, 35.8°N)")
-print("  搜索半径: 50 km")
-print("  典型特征: 黄土高原，海拔 800-1200m，昼夜温差大")
-print("  金标准产区: 世界最佳苹果优生区")
-
-# 2. 加载数据源 (Data Acquisition)
-# 地形数据：NASA SRTM DEM (30m分辨率)
-dem = ee.Image("USGS/SRTMGL1_003").clip(roi)
-
-# 气候数据：WorldClim V1 Bioclim (历史气候数据)
-# BIO1 = Annual Mean Temperature, BIO12 = Annual Precipitation
-climate = ee.Image("WORLDCLIM/V1/BIO").clip(roi)
-temp = climate.select('bio01').multiply(0.1) # 缩放因子
-precip = climate.select('bio12')
-
-# 土地覆盖：Sentinel-2 (用于剔除水体和建筑)
-s2 = ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED").filterBounds(roi).first()
-# 计算地形因子
-slope = ee.Terrain.slope(dem)
-aspect = ee.Terrain.aspect(dem)
+def initialize():
+    try:
+        ee.Initialize(project=project_id)
+    except Exception as e:
+        print(f"初始化失败: {e}")
+        print("请完成以下步骤:")
+        print("1. 访问 https://console.cloud.google.com 创建一个项目")
+        print("2. 设置环境变量: set GCP_PROJECT_ID=your-project-id")
+        print("3. 重新运行脚本")
+        raise RuntimeError(f"GEE 初始化失败: {e}") from e
 
 # --- 定义重分类函数 (Reclassify Helper) ---
 # 将连续值映射为 1-9 的 AHP 得分
+# 每个函数用一条 ee.Image.expression 完成分段映射，服务器端编译为单个像元内核
+# 陡坡不适宜
+SLOPE_EXPR = "(s < 5) ? 9 : (s < 15) ? 8 : (s < 25) ? 6 : 1"
+# 阳坡 (135-225度) 得分高，东南/西南坡次之，阴坡得分低
+ASPECT_EXPR = "(a >= 135 && a < 225) ? 9 : (a >= 90 && a < 270) ? 7 : 3"
+# 假设目标作物为高山苹果，适宜海拔 800-1300m
+ELEV_EXPR = "(h < 600) ? 3 : (h < 800) ? 6 : (h < 1300) ? 9 : 5"
+# 温度线性映射到 1-9 (结果再 clamp 到 CLIMATE_CLAMP)
+CLIMATE_EXPR = "(t + 50) / 100 * 8 + 1"
+CLIMATE_CLAMP = (1, 9)
+# 加权求和与 ×10 缩放 (归一化到 0-100 分)
+FINAL_EXPR = "10 * (ws * s + we * e + wa * a + wc * c)"
+
 def reclassify_slope(img):
-    return ee.Image(1) \
-        .where(img.lt(5), 9)    \
-        .where(img.gte(5).And(img.lt(15)), 8) \
-        .where(img.gte(15).And(img.lt(25)), 6) \
-        .where(img.gte(25), 1)  # 陡坡不适宜
+    return img.expression(SLOPE_EXPR, {'s': img})
 
 def reclassify_aspect(img):
-    # 阳坡 (135-225度) 得分高
-    return ee.Image(1) \
-        .where(img.gte(135).And(img.lt(225)), 9) \
-        .where(img.gte(90).And(img.lt(135)), 7) \
-        .where(img.gte(225).And(img.lt(270)), 7) \
-        .where(img.lt(90).Or(img.gte(270)), 3) # 阴坡得分低
+    return img.expression(ASPECT_EXPR, {'a': img})
 
 def reclassify_elevation(img):
-    # 假设目标作物为高山苹果，适宜海拔 800-1300m
-    return ee.Image(1) \
-        .where(img.lt(600), 3) \
-        .where(img.gte(600).And(img.lt(800)), 6) \
-        .where(img.gte(800).And(img.lt(1300)), 9) \
-        .where(img.gte(1300), 5)
-
-# 应用重分类
-score_slope = reclassify_slope(slope)
-score_aspect = reclassify_aspect(aspect)
-score_dem = reclassify_elevation(dem)
+    return img.expression(ELEV_EXPR, {'h': img})
 
 # --- AHP 加权叠加 ---
 # 权重和必须为 1.0
@@ -82,71 +50,211 @@ w_elev = 0.25
 w_aspect = 0.20
 w_climate = 0.20
 
-# 简单的气候得分 (温度越接近最佳值越好，假设最佳温度范围为 15-25°C)
-# 温度已缩放，范围大约 -50 到 50 (单位0.1°C)
-# 使用简单的线性映射到 1-9
-score_climate = temp.add(50).divide(100).multiply(8).add(1).clamp(1, 9)
-
-# 计算最终适宜性指数 LSI (Land Suitability Index)
-lsi = score_slope.multiply(w_slope) \
-    .add(score_dem.multiply(w_elev)) \
-    .add(score_aspect.multiply(w_aspect)) \
-    .add(score_climate.multiply(w_climate))
-
-# 最终结果归一化到 0-100 分，便于展示
-final_suitability = lsi.multiply(10).rename('Suitability_Score')
-
-# --- 可视化 ---
-Map = geemap.Map(center=[35.8, 109.4], zoom=11, basemap='SATELLITE')
-
-# 设置可视化参数：红黄绿配色 (红=高适宜, 绿=不适宜)
-vis_params = {
-    'min': 30,
-    'max': 90,
-    'palette': ['green', 'yellow', 'orange', 'red']
-}
-
-Map.addLayer(final_suitability, vis_params, 'Apple Orchard Suitability (AHP)')
-
-# 过滤出 "S级地块" (得分 > 85)
-prime_locations = final_suitability.gt(85).selfMask()
-Map.addLayer(prime_locations, {'palette': ['purple']}, 'Prime Locations (S-Class)')
-
-# 保存地图到 HTML 文件
-output_file = 'suitability_map.html'
-Map.to_html(output_file)
-print(f"✓ 地图已保存到: {output_file}")
-
-# 计算并打印统计信息
-print("\n=== 适宜性分析结果 ===")
-print(f"分析区域中心: 陕西省洛川县 (109.4°E, 35.8°N)")
-print(f"分析半径: 50 km")
-print(f"\n权重分配:")
-print(f"  - 坡度: {w_slope*100:.0f}%")
-print(f"  - 海拔: {w_elev*100:.0f}%")
-print(f"  - 坡向: {w_aspect*100:.0f}%")
-print(f"  - 气候: {w_climate*100:.0f}%")
-
-# 获取统计数据（采样点）
-stats = final_suitability.sample(
-    region=roi,
-    scale=500,
-    numPixels=100
-).aggregate_stats('Suitability_Score')
-
-try:
-    mean_score = stats.get('mean').getInfo()
-    print(f"\n平均适宜性得分: {mean_score:.1f}")
-    print(f"适宜性等级划分:")
-    print(f"  90-100: S级 (极优)")
-    print(f"  80-90:  A级 (优秀)")
-    print(f"  70-80:  B级 (良好)")
-    print(f"  60-70:  C级 (中等)")
-    print(f"  <60:    D级 (不推荐)")
-except Exception as e:
-    print(f"\n注意: 无法获取统计数据 ({e})")
-
-print(f"\n请打开 {output_file} 查看详细地图！")
-print("地图图层:")
-print("  - Apple Orchard Suitability (AHP): 完整适宜性分析")
-print("  - Prime Locations (S-Class): 高分地块 (>85分)")
\ No newline at end of file
+# ROI：以洛川为中心的缓冲区
+ROI_CENTER = [109.4, 35.8]
+ROI_RADIUS = 50000  # 米
+
+# --- 结果缓存 (GEE Asset) ---
+# 首次运行把 final_suitability 导出为 Asset，之后直接读取，避免每次重新切片 SRTM / WorldClim 并重算重分类
+# Asset 名与本地标记都带有模型参数 (表达式、权重、ROI、导出分辨率) 的短哈希，
+# 修改任一参数即对应新的 Asset，旧结果不会被误用
+PERSIST_ASSET = True
+EXPORT_SCALE = 30  # 与 SRTM 原生分辨率一致，缓存结果与实时计算结果相同
+
+def _model_hash():
+    spec = repr((
+        SLOPE_EXPR, ASPECT_EXPR, ELEV_EXPR, CLIMATE_EXPR, CLIMATE_CLAMP, FINAL_EXPR,
+        w_slope, w_elev, w_aspect, w_climate, ROI_CENTER, ROI_RADIUS, EXPORT_SCALE
+    ))
+    return hashlib.sha1(spec.encode('utf-8')).hexdigest()[:8]
+
+MODEL_HASH = _model_hash()
+ASSET_ID = os.getenv('AHP_ASSET_ID', f'projects/{project_id}/assets/ahp_final_suitability') + f'_{MODEL_HASH}'
+# 本地标记：记录已提交导出任务的 ID，避免重复提交 (固定在模块目录，不随调用方工作目录变化)
+EXPORT_SENTINEL = os.path.join(os.path.dirname(os.path.abspath(__file__)), f'.ahp_asset_export_{MODEL_HASH}')
+# 仍在进行中的任务状态；其余 (FAILED / CANCELLED / COMPLETED 但 Asset 不存在等) 均需重新提交
+PENDING_TASK_STATES = ('UNSUBMITTED', 'READY', 'RUNNING')
+
+OUTPUT_MAP = 'suitability_map.html'
+
+def asset_exists(asset_id):
+    try:
+        return ee.data.getInfo(asset_id) is not None
+    except Exception:
+        return False
+
+def export_pending():
+    """
+    标记文件记录的导出任务是否仍在进行；任务已失败、取消或查询不到时删除标记，以便重新提交
+    """
+    if not os.path.exists(EXPORT_SENTINEL):
+        return False
+    with open(EXPORT_SENTINEL) as f:
+        task_id = f.read().strip()
+    try:
+        state = ee.data.getTaskStatus(task_id)[0].get('state')
+    except Exception:
+        state = None
+    if state in PENDING_TASK_STATES:
+        return True
+    print(f"导出任务 {task_id} 状态为 {state}，将重新提交")
+    os.remove(EXPORT_SENTINEL)
+    return False
+
+def build_suitability():
+    """
+    构建洛川产区的 AHP 适宜性图层，返回 (roi, final_suitability)
+    需先调用 initialize()
+    """
+    # 1. 定义感兴趣区域 (ROI) - 陕西洛川富士苹果典型产区
+    # 洛川县：世界最佳苹果优生区之一，位于陕西省延安市
+    # 地理位置：109.4°E, 35.8°N，海拔 800-1200m
+    # 搜索范围：以洛川为中心，半径约 50km 的周边地区
+    roi = ee.Geometry.Point(ROI_CENTER).buffer(ROI_RADIUS).bounds()  # 50km 半径
+
+    print("✓ ROI 已设置为陕西洛川富士苹果产区及周边")
+    print("  中心位置: 洛川县 (109.4°E, 35.8°N)")
+    print("  搜索半径: 50 km")
+    print("  典型特征: 黄土高原，海拔 800-1200m，昼夜温差大")
+    print("  金标准产区: 世界最佳苹果优生区")
+
+    if PERSIST_ASSET and asset_exists(ASSET_ID):
+        print(f"✓ 使用已缓存的适宜性结果: {ASSET_ID}")
+        return roi, ee.Image(ASSET_ID)
+
+    # 2. 加载数据源 (Data Acquisition)
+    # 地形数据：NASA SRTM DEM (30m分辨率)
+    dem = ee.Image("USGS/SRTMGL1_003").clip(roi)
+
+    # 气候数据：WorldClim V1 Bioclim (历史气候数据)
+    # BIO1 = Annual Mean Temperature, BIO12 = Annual Precipitation
+    climate = ee.Image("WORLDCLIM/V1/BIO").clip(roi)
+    temp = climate.select('bio01').multiply(0.1) # 缩放因子
+
+    # 计算地形因子
+    slope = ee.Terrain.slope(dem)
+    aspect = ee.Terrain.aspect(dem)
+
+    # 应用重分类
+    score_slope = reclassify_slope(slope)
+    score_aspect = reclassify_aspect(aspect)
+    score_dem = reclassify_elevation(dem)
+
+    # 简单的气候得分 (温度越接近最佳值越好，假设最佳温度范围为 15-25°C)
+    # 温度已缩放，范围大约 -50 到 50 (单位0.1°C)
+    # 使用简单的线性映射到 1-9
+    score_climate = temp.expression(CLIMATE_EXPR, {'t': temp}).clamp(*CLIMATE_CLAMP)
+
+    # 计算最终适宜性指数 LSI (Land Suitability Index)，并归一化到 0-100 分，便于展示
+    # 加权求和与 ×10 缩放合并为单条表达式，只生成一幅结果影像
+    final_suitability = ee.Image().expression(
+        FINAL_EXPR,
+        {
+            's': score_slope, 'e': score_dem, 'a': score_aspect, 'c': score_climate,
+            'ws': w_slope, 'we': w_elev, 'wa': w_aspect, 'wc': w_climate
+        }
+    ).rename('Suitability_Score')
+
+    if PERSIST_ASSET:
+        if not export_pending():
+            # 导出只是加速后续运行的缓存：提交失败 (无 Asset 写权限、配额等) 时不影响本次结果
+            try:
+                task = ee.batch.Export.image.toAsset(
+                    image=final_suitability,
+                    description='ahp_final_suitability',
+                    assetId=ASSET_ID,
+                    region=roi,
+                    scale=EXPORT_SCALE,
+                    maxPixels=1e13
+                )
+                task.start()
+                with open(EXPORT_SENTINEL, 'w') as f:
+                    f.write(task.id)
+                print(f"✓ 已提交导出任务 {task.id} -> {ASSET_ID}，完成后再次运行将直接读取")
+            except (ee.EEException, OSError) as e:
+                print(f"⚠ 提交导出任务失败 ({e})，本次使用实时计算结果")
+        else:
+            print(f"导出任务已提交 (见 {EXPORT_SENTINEL})，本次仍使用实时计算结果")
+
+    return roi, final_suitability
+
+def run(output_dir='.'):
+    """
+    完整的 AHP 适宜性分析：生成适宜性地图并打印统计报告
+    返回 {'map': 地图 HTML 路径}
+    """
+    initialize()
+    roi, final_suitability = build_suitability()
+
+    # --- 可视化 ---
+    Map = geemap.Map(center=[35.8, 109.4], zoom=11, basemap='SATELLITE')
+
+    # 设置可视化参数：红黄绿配色 (红=高适宜, 绿=不适宜)
+    vis_params = {
+        'min': 30,
+        'max': 90,
+        'palette': ['green', 'yellow', 'orange', 'red']
+    }
+
+    Map.addLayer(final_suitability, vis_params, 'Apple Orchard Suitability (AHP)')
+
+    # 过滤出 "S级地块" (得分 > 85)
+    prime_locations = final_suitability.gt(85).selfMask()
+    Map.addLayer(prime_locations, {'palette': ['purple']}, 'Prime Locations (S-Class)')
+
+    # 保存地图到 HTML 文件
+    os.makedirs(output_dir, exist_ok=True)
+    output_file = os.path.join(output_dir, OUTPUT_MAP)
+    Map.to_html(output_file)
+    print(f"✓ 地图已保存到: {output_file}")
+
+    # 计算并打印统计信息
+    print("\n=== 适宜性分析结果 ===")
+    print(f"分析区域中心: 陕西省洛川县 (109.4°E, 35.8°N)")
+    print(f"分析半径: 50 km")
+    print(f"\n权重分配:")
+    print(f"  - 坡度: {w_slope*100:.0f}%")
+    print(f"  - 海拔: {w_elev*100:.0f}%")
+    print(f"  - 坡向: {w_aspect*100:.0f}%")
+    print(f"  - 气候: {w_climate*100:.0f}%")
+
+    # 获取统计数据（采样点）
+    stats = final_suitability.sample(
+        region=roi,
+        scale=500,
+        numPixels=100
+    ).aggregate_stats('Suitability_Score')
+
+    # 报告所需的全部标量打包进一个 ee.Dictionary，一次 getInfo 取回
+    summary = ee.Dictionary({
+        'mean': stats.get('mean'),
+        'min': stats.get('min'),
+        'max': stats.get('max'),
+        'roi_area_km2': roi.area(maxError=100).divide(1e6)
+    })
+
+    try:
+        report = summary.getInfo()
+        print(f"\n分析面积: {report['roi_area_km2']:.0f} km²")
+        print(f"平均适宜性得分: {report['mean']:.1f} (采样范围 {report['min']:.1f} - {report['max']:.1f})")
+        print(f"适宜性等级划分:")
+        print(f"  90-100: S级 (极优)")
+        print(f"  80-90:  A级 (优秀)")
+        print(f"  70-80:  B级 (良好)")
+        print(f"  60-70:  C级 (中等)")
+        print(f"  <60:    D级 (不推荐)")
+    except Exception as e:
+        print(f"\n注意: 无法获取统计数据 ({e})")
+
+    print(f"\n请打开 {output_file} 查看详细地图！")
+    print("地图图层:")
+    print("  - Apple Orchard Suitability (AHP): 完整适宜性分析")
+    print("  - Prime Locations (S-Class): 高分地块 (>85分)")
+
+    return {'map': output_file}
+
+if __name__ == '__main__':
+    try:
+        run()
+    except RuntimeError:
+        exit(1)
@@ -1,21 +1,40 @@
 import numpy as np
-import pandas as pd
 import matplotlib.pyplot as plt
 from scipy.signal import savgol_filter
-from scipy.interpolate import interp1d
 import ee
 import os
+import csv
+import math
+import time
 import geemap
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+from _sim import slope_dist, find_peaks
+
+import AHP
 
 # ==========================================
 # 输出设置
 # ==========================================
 TOP_N = 10
 SIM_THRESHOLD = 60.0
+COARSE_SIM_THRESHOLD = 80.0  # 服务器端谐波粗筛阈值，低于此值的候选不再下载 NDVI 精匹配
+PRUNE_K = 5.0  # 年均 NDVI 差预筛系数：100·exp(-PRUNE_K·|Δmean|) < SIM_THRESHOLD 的候选跳过精匹配 (约 |Δmean| > 0.1)
+USE_HARMONIC_FIT = True  # True: 用服务器端谐波系数重建曲线; False: 下载逐日 NDVI 后做 Savitzky-Golay 平滑
+GRID_SCALE = 5000  # 候选网格边长 (米)
+CANDIDATE_K = 20  # 参考网格之外，按网格平均适宜性取前 K 个网格中心作为候选点
+MODIS_COLLECTION = 'MODIS/006/MOD13A1'  # 500m 16-day NDVI，与 MOD13Q1 (250m) 同周期但每次归约像元约少 4 倍
+MODIS_SCALE = 500
+TILE_SCALE = 4  # 较大区域归约时降低单瓦片内存，避免内存超限
+MAX_WORKERS = 4  # 并发 GEE 请求数 (互不依赖的 getInfo 同时发出)
 EXPORT_CSV = True
 EXPORT_MAP = True
 OUTPUT_CSV = 'similar_regions.csv'
 OUTPUT_MAP = 'similar_regions_map.html'
+OUTPUT_PNG = 'phenology_matching_analysis.png'
+OUTPUT_WEBP = 'phenology_matching_analysis.webp'  # 网页展示用缩略图，高清 PNG 仅供下载
+THUMB_SIZE = (1200, 1200)
 
 # ==========================================
 # 1. 数据模拟 (Data Simulation)
@@ -31,63 +50,61 @@ def double_logistic(t, params):
     decay = 1 / (1 + np.exp(p[3] * (t - p[1])))
     return p[4] + p[5] * (growth - (1 - decay)) # 简化的双逻辑斯蒂形态
 
-# 使用 GEE 数据代替模拟数据
-# 初始化 Earth Engine（使用与 HAP 相同的项目）
-project_id = os.getenv('GCP_PROJECT_ID', 'terrior-hunter')
-try:
-    ee.Initialize(project=project_id)
-except Exception:
-    ee.Authenticate()
-    ee.Initialize(project=project_id)
+# 函数：带指数退避重试的 getInfo (GEE 偶发限流/超时)
+def get_info(obj, retries=3, backoff=1.0):
+    for attempt in range(retries):
+        try:
+            return obj.getInfo()
+        except ee.EEException:
+            if attempt == retries - 1:
+                raise
+            time.sleep(backoff * 2 ** attempt)
 
-# 导入 HAP 模块，获取已计算的适宜性图层和 ROI
-import AHP
-final = AHP.final_suitability
-roi = AHP.roi
-
-print("\n" + "="*60)
-print("富士苹果相似产区智能检索系统")
-print("="*60)
-print("金标准产区: 陕西洛川 (109.4°E, 35.8°N)")
-print("搜索范围: 50km 半径周边地区")
-print("目标: 找到与洛川生态条件接近的潜在优质地块")
-print("="*60 + "\n")
-
-# 找到得分>60 的高分区并向量化，选取面积最大的多边形作为参考区
-prime = final.gt(60).selfMask()
-# 增加 scale 和 eightConnected 参数，减少要素数量，加快处理
-vec = prime.reduceToVectors(
-    scale=1000,  # 提高分辨率，减少过度分割
-    geometry=roi,
-    geometryType='polygon',
-    maxPixels=1e13,
-    eightConnected=True  # 使用8邻接来简化要素
-)
-# 添加面积属性到 feature，进行服务器端计算
-vec_with_area = vec.map(lambda f: f.set('area', f.geometry().area(maxError=50)))
-# 排序并选取面积最大的要素
-best_feat = vec_with_area.sort('area', False).first()
-if best_feat is None:
-    raise RuntimeError('未找到高分区域，请确认 HAP.py 中 final_suitability 是否包含得分>60 的区域。')
-best_geom = best_feat.geometry()
-
-# 函数：从 MODIS 获取年内 NDVI 时序（按 MOD13Q1 16-day）
-def get_ndvi_series(geometry, year=2020):
+# 初始化 Earth Engine（使用与 AHP 相同的项目）
+project_id = AHP.project_id
+
+def initialize():
+    try:
+        ee.Initialize(project=project_id)
+    except Exception:
+        ee.Authenticate()
+        ee.Initialize(project=project_id)
+
+# 函数：在 ROI 上按网格平均适宜性选出参考区与候选点
+def find_candidates(roi, final):
+    """
+    返回 (best_geom, sample_pts)：得分最高的网格作为参考区，其余 K 个高分网格中心作为候选点
+    """
+    # 在 ROI 上铺设固定网格，按网格平均适宜性排序 (不做全局矢量化，省去 reduceToVectors 的开销)
+    grid = roi.coveringGrid(ee.Projection('EPSG:3857'), GRID_SCALE)
+    grid_scores = final.reduceRegions(collection=grid, reducer=ee.Reducer.mean(), scale=500) \
+        .filter(ee.Filter.notNull(['mean']))
+    # 一次请求取回得分最高的 K+1 个网格 (含网格中心点)
+    ranked_cells = get_info(
+        grid_scores.sort('mean', False).limit(CANDIDATE_K + 1)
+        .map(lambda f: f.set('center', f.geometry().centroid(maxError=1)))
+    ).get('features', [])
+    # 得分最高的网格作为参考区
+    if not ranked_cells or ranked_cells[0]['properties']['mean'] <= 60:
+        raise RuntimeError('未找到高分区域，请确认 AHP.py 中 final_suitability 是否包含得分>60 的区域。')
+    best_geom = ee.Geometry(ranked_cells[0]['geometry'])
+
+    # 其余 K 个高分网格的中心点作为候选目标 (确定性分层选点，避免在整个 ROI 上随机采样)
+    sample_pts = [
+        {'type': 'Feature', 'geometry': cell['properties']['center'], 'properties': {'suitability': cell['properties']['mean']}}
+        for cell in ranked_cells[1:]
+    ]
+    return best_geom, sample_pts
+
+def _modis_ndvi(year):
     start = f"{year}-01-01"
     end = f"{year}-12-31"
-    col = ee.ImageCollection('MODIS/006/MOD13Q1').filterDate(start, end).select('NDVI')
-    
-    # 为每个影像添加 NDVI 均值作为属性
-    def add_ndvi_property(img):
-        ndvi_mean = img.reduceRegion(ee.Reducer.mean(), geometry, scale=250, bestEffort=True).get('NDVI')
-        return img.set('ndvi_mean', ndvi_mean)
-    
-    col_with_ndvi = col.map(add_ndvi_property)
-    
-    # 用 aggregate_array 分别提取时间戳和 NDVI 值
-    dates = col_with_ndvi.aggregate_array('system:time_start').getInfo()
-    values = col_with_ndvi.aggregate_array('ndvi_mean').getInfo()
-    
+    return ee.ImageCollection(MODIS_COLLECTION).filterDate(start, end).select('NDVI')
+
+def _to_daily_series(dates, values):
+    """
+    把 (时间戳, NDVI) 观测插值为 365 天的逐日序列
+    """
     if not dates or not values or len(dates) == 0:
         return np.full(365, np.nan)
     
@@ -119,20 +136,115 @@ def get_ndvi_series(geometry, year=2020):
     if valid_idx.sum() < 3:
         return np.full(365, np.nan)
     
-    f = interp1d(x[valid_idx], y[valid_idx], kind='linear', fill_value='extrapolate')
-    full = f(np.arange(1, 366))
+    # 线性插值补齐到逐日；首/末次观测之外按端点值常数延伸 (不做线性外推，避免年初/年末曲线发散)
+    order = np.argsort(x[valid_idx])
+    full = np.interp(np.arange(1, 366), x[valid_idx][order], y[valid_idx][order])
     return full
 
-# 参考样本：使用最佳高分区的 NDVI 序列
-ref_ndvi = get_ndvi_series(best_geom, year=2020)
+# 函数：从 MODIS 获取年内 NDVI 时序（按 MOD13A1 16-day）
+def get_ndvi_series(geometry, year=2020):
+    col = _modis_ndvi(year)
+    
+    # 为每个影像添加 NDVI 均值作为属性
+    def add_ndvi_property(img):
+        ndvi_mean = img.reduceRegion(
+            ee.Reducer.mean(), geometry, scale=MODIS_SCALE, bestEffort=True, tileScale=TILE_SCALE
+        ).get('NDVI')
+        return img.set('ndvi_mean', ndvi_mean)
+    
+    col_with_ndvi = col.map(add_ndvi_property)
+    
+    # 用 aggregate_array 提取时间戳和 NDVI 值，打包为一个字典一次取回
+    cols = get_info(ee.Dictionary({
+        'dates': col_with_ndvi.aggregate_array('system:time_start'),
+        'values': col_with_ndvi.aggregate_array('ndvi_mean')
+    }))
+    return _to_daily_series(cols['dates'], cols['values'])
+
+# 函数：一次请求批量获取所有候选点的 NDVI 时序
+def get_ndvi_series_batch(fc, year=2020):
+    """
+    fc 中每个要素需带有 'pid' 属性；返回 {pid: 365 天 NDVI 序列}
+    所有影像 × 所有点的均值在服务器端一次 reduceRegions 完成，只有一次 getInfo 往返
+    """
+    col = _modis_ndvi(year)
+    
+    def reduce_image(img):
+        t = img.get('system:time_start')
+        stats = img.reduceRegions(collection=fc, reducer=ee.Reducer.mean(), scale=MODIS_SCALE, tileScale=TILE_SCALE)
+        # 只保留属性，丢弃几何以减小返回体积
+        return stats.map(lambda f: ee.Feature(None, {'pid': f.get('pid'), 't': t, 'ndvi': f.get('mean')}))
+    
+    table = get_info(col.map(reduce_image).flatten()).get('features', [])
+    
+    # 按 pid 分发为各点的 (时间戳, NDVI) 列表
+    obs = {}
+    for feat in table:
+        props = feat.get('properties', {})
+        dates, values = obs.setdefault(props.get('pid'), ([], []))
+        dates.append(props.get('t'))
+        values.append(props.get('ndvi'))
+    return {pid: _to_daily_series(dates, values) for pid, (dates, values) in obs.items()}
 
-# 在 ROI 内采样若干点作为候选目标（减少采样点数以加快处理）
-sample_pts = final.sample(
-    region=roi,
-    scale=500,
-    numPixels=20,  # 减少采样点数从 50 到 20
-    geometries=True
-).getInfo().get('features', [])
+# 谐波模型系数：NDVI(t) ≈ a0 + a1·cos(ωt) + b1·sin(ωt) + a2·cos(2ωt) + b2·sin(2ωt)，ω = 2π/365
+HARMONIC_BANDS = ['a0', 'a1', 'b1', 'a2', 'b2']
+
+# 函数：在服务器端逐像元拟合 NDVI 年内谐波模型
+def harmonic_coefficients(year=2020):
+    """
+    对 MODIS NDVI 时序逐像元做二阶谐波最小二乘回归 (ee.Reducer.linearRegression)
+    返回系数影像，波段为 HARMONIC_BANDS
+    """
+    def add_harmonics(img):
+        w = ee.Number(img.date().getRelative('day', 'year')).multiply(2 * math.pi / 365)
+        w2 = w.multiply(2)
+        ndvi = img.select('NDVI').multiply(0.0001).rename('NDVI')
+        x = ee.Image.cat([
+            ee.Image(1), ee.Image(w.cos()), ee.Image(w.sin()), ee.Image(w2.cos()), ee.Image(w2.sin())
+        ]).rename(HARMONIC_BANDS).toFloat().updateMask(ndvi.mask())
+        return x.addBands(ndvi.toFloat())
+    
+    fit = _modis_ndvi(year).map(add_harmonics) \
+        .reduce(ee.Reducer.linearRegression(numX=len(HARMONIC_BANDS), numY=1))
+    return fit.select('coefficients').arrayProject([0]).arrayFlatten([HARMONIC_BANDS])
+
+# 函数：以参考区谐波系数为基准，逐像元计算粗相似度 (0-100)
+def harmonic_similarity(coefs, ref_coefs):
+    """
+    谐波基在一年内正交，两条曲线的均方差可直接由系数差得到：
+    MSE = Δa0² + ½·Σ(Δa_k² + Δb_k²)，相似度 = 100 · (1 - RMSE)
+    """
+    ref = ee.Image.constant(ee.Dictionary(ref_coefs).values(HARMONIC_BANDS)).rename(HARMONIC_BANDS)
+    weights = ee.Image.constant([1.0] + [0.5] * (len(HARMONIC_BANDS) - 1))
+    mse = coefs.subtract(ref).pow(2).multiply(weights).reduce(ee.Reducer.sum())
+    return ee.Image(1).subtract(mse.sqrt()).multiply(100).rename('coarse_similarity')
+
+# 函数：一次请求获取所有候选点的服务器端粗相似度与谐波系数
+def get_harmonic_scores(coefs, sim_img, fc):
+    """
+    fc 中每个要素需带有 'pid' 属性；返回 {pid: (粗相似度, [a0, a1, b1, a2, b2])}
+    每点只传回 6 个浮点数，无有效像元的点不出现在结果中
+    """
+    scored = coefs.addBands(sim_img) \
+        .reduceRegions(collection=fc, reducer=ee.Reducer.mean(), scale=MODIS_SCALE, tileScale=TILE_SCALE) \
+        .filter(ee.Filter.notNull(['coarse_similarity']))
+    cols = get_info(ee.Dictionary({
+        name: scored.aggregate_array(name)
+        for name in ['pid', 'coarse_similarity'] + HARMONIC_BANDS
+    }))
+    coef_rows = zip(*[cols[b] for b in HARMONIC_BANDS])
+    return {pid: (score, list(row)) for pid, score, row in zip(cols['pid'], cols['coarse_similarity'], coef_rows)}
+
+# 函数：由谐波系数在本地重建 365 天曲线 (或其 deriv 阶导数)
+def harmonic_curve(coefs, deriv=0):
+    t = np.arange(365)
+    curve = np.full(365, coefs[0] if deriv == 0 else 0.0)
+    for k in range(1, len(coefs) // 2 + 1):
+        kw = k * 2 * np.pi / 365
+        # d^n/dt^n cos(kωt) = (kω)^n · cos(kωt + nπ/2)，sin 同理
+        phase = kw * t + deriv * np.pi / 2
+        curve += kw ** deriv * (coefs[2 * k - 1] * np.cos(phase) + coefs[2 * k] * np.sin(phase))
+    return curve
 
 # 作为后续匹配用的时间轴
 days = np.arange(1, 366)
@@ -140,6 +252,23 @@ days = np.arange(1, 366)
 # ==========================================
 # 2. 特征提取：寻找“关节” (Landmark Extraction)
 # ==========================================
+# Savitzky-Golay 滤波 (mode='interp') 对固定长度序列是线性算子：
+# 预先把 365 天的平滑与三阶导数算子展开成矩阵，每条曲线只需一次矩阵乘法，
+# 省去每次调用的系数求解与边缘多项式拟合，结果与 savgol_filter 一致
+SG_WINDOW = 31
+SG_POLYORDER = 3
+LANDMARK_REL_HEIGHT = 0.05  # 关键点峰高阈值：相对 |d3| 最大值的比例
+_SG_OPERATORS = {
+    deriv: savgol_filter(np.eye(365), SG_WINDOW, SG_POLYORDER, deriv=deriv, axis=0)
+    for deriv in (0, 3)  # extract_landmarks 只用到平滑曲线与三阶导数
+}
+
+def sg_filter(series, deriv=0):
+    op = _SG_OPERATORS.get(deriv) if series.size == 365 else None
+    if op is None:
+        return savgol_filter(series, SG_WINDOW, SG_POLYORDER, deriv=deriv)
+    return op @ series
+
 def clean_ndvi_series(ndvi_series):
     series = np.array(ndvi_series, dtype=float)
     if np.all(np.isnan(series)):
@@ -161,24 +290,37 @@ def extract_landmarks(ndvi_series):
         return None, None
 
     # a. 平滑去噪 (Smoothing)
-    smooth_ndvi = savgol_filter(cleaned, window_length=31, polyorder=3)
+    smooth_ndvi = sg_filter(cleaned)
     
     # b. 计算导数 (Derivatives)
-    d1 = np.gradient(smooth_ndvi) # 一阶导数 (生长速度)
-    d2 = np.gradient(d1)          # 二阶导数 (加速度)
-    d3 = np.gradient(d2)          # 三阶导数 (曲率变化率近似)
+    # SG 滤波可直接输出 k 阶导数，一次得到三阶导数 (曲率变化率近似)，
+    # 无需对平滑结果连续做三次 np.gradient
+    d3 = sg_filter(cleaned, deriv=3)
     
+    return smooth_ndvi, landmarks_from_d3(d3)
+
+def extract_landmarks_harmonic(coefs):
+    """
+    谐波模型版本：曲线与三阶导数均由 5 个谐波系数解析得到，无需逐日 NDVI 与 SG 滤波
+    """
+    if coefs is None or any(c is None for c in coefs):
+        return None, None
+    return harmonic_curve(coefs), landmarks_from_d3(harmonic_curve(coefs, deriv=3))
+
+def landmarks_from_d3(d3):
     # c. 寻找关键点 (Landmarks)
     # 论文中：Greenup/Maturity 是曲率变化率的局部最大值
     #        Senescence/Dormancy 是曲率变化率的局部最小值
     # 这里简化逻辑：寻找 d3 的极值点作为近似特征
     
-    # 简单的峰值检测
-    from scipy.signal import find_peaks
+    # 简单的峰值检测 (_sim.find_peaks：有 numba 时为编译版本)
+    # 峰高阈值取自身 |d3| 最大值的一定比例：谐波解析导数量级约 (kω)³ ≈ 1e-6，
+    # 固定阈值会让谐波路径永远检测不到峰值；SG 路径同样按比例处理，两条路径标准一致
+    height = LANDMARK_REL_HEIGHT * np.abs(d3).max()
     # 生长期 (Upward): 找 d3 的正峰值
-    upward_peaks, _ = find_peaks(d3[:180], height=0.0001, distance=20) 
+    upward_peaks = find_peaks(d3[:180], height=height, distance=20)
     # 衰退期 (Downward): 找 d3 的负峰值 (即 -d3 的正峰值)
-    downward_peaks, _ = find_peaks(-d3[180:], height=0.0001, distance=20)
+    downward_peaks = find_peaks(-d3[180:], height=height, distance=20)
     downward_peaks += 180 # 修正索引
     
     # 选取最重要的4个点 (假设)
@@ -194,11 +336,28 @@ def extract_landmarks(ndvi_series):
         # 兜底：如果没有检测到完美峰值，使用简单的阈值法或固定点
         landmarks = {'Greenup': 100, 'Maturity': 150, 'Senescence': 260, 'Dormancy': 300}
         
-    return smooth_ndvi, landmarks
+    return landmarks
 
 # ==========================================
 # 3. 混合匹配：MICA 算法 (Phenophase Matching)
 # ==========================================
+def _interp_extrapolate(x, xp, fp):
+    """
+    分段线性插值，区间外按首/末段斜率线性外推
+    (等价于 interp1d(kind='linear', fill_value='extrapolate')，但直接走 np.interp 的 C 循环)
+    """
+    x = np.asarray(x, dtype=float)
+    xp = np.asarray(xp, dtype=float)
+    fp = np.asarray(fp, dtype=float)
+    y = np.interp(x, xp, fp)
+    left = x < xp[0]
+    right = x > xp[-1]
+    if left.any():
+        y[left] = fp[0] + (x[left] - xp[0]) * (fp[1] - fp[0]) / (xp[1] - xp[0])
+    if right.any():
+        y[right] = fp[-1] + (x[right] - xp[-1]) * (fp[-1] - fp[-2]) / (xp[-1] - xp[-2])
+    return y
+
 def warp_and_match(ref_curve, tgt_curve, ref_lm, tgt_lm):
     """
     利用 MICA (Multi-Interval Curve Alignment) 对齐曲线
@@ -214,41 +373,36 @@ def warp_and_match(ref_curve, tgt_curve, ref_lm, tgt_lm):
     x_ref = [0] + key_points_ref + [365]
     x_tgt = [0] + key_points_tgt + [365]
     
-    # 建立映射关系: Target time -> Reference time
-    warp_func = interp1d(x_tgt, x_ref, kind='linear', fill_value="extrapolate")
-    
-    # b. 扭曲目标曲线 (Warp Target Curve)
-    # 计算“校正后”的 Target 曲线在标准时间轴上的形态
-    warped_time = warp_func(np.arange(len(tgt_curve)))
     # 注意：这里我们实际上是想看 Target 在 Ref 时间轴上的表现
     # 为简单起见，我们将 Target 的值“移”到 Ref 的时间点上
     
-    # 反向插值：在 Ref 的时间网格上，找到对应的 Target 值
+    # b. 反向插值：在 Ref 的时间网格上，找到对应的 Target 值
     # 真实的 MICA 更复杂，这里做演示级简化
-    inverse_warp = interp1d(x_ref, x_tgt, kind='linear', fill_value="extrapolate")
-    original_time_indices = inverse_warp(np.arange(len(ref_curve)))
+    original_time_indices = _interp_extrapolate(np.arange(len(ref_curve)), x_ref, x_tgt)
     # 限制索引范围
     original_time_indices = np.clip(original_time_indices, 0, 364)
     
-    warped_tgt_curve = interp1d(np.arange(len(tgt_curve)), tgt_curve)(original_time_indices)
+    # c. 扭曲目标曲线 (Warp Target Curve)
+    warped_tgt_curve = np.interp(original_time_indices, np.arange(len(tgt_curve)), tgt_curve)
     
     return warped_tgt_curve
 
 # ==========================================
 # 4. 相似度计算：基于斜率距离 (Slope-based Distance)
 # ==========================================
-def calculate_similarity(curve1, curve2):
+def calculate_similarity(ref_slope, curve2):
     """
     论文公式 (1): 基于斜率的距离函数
     d(Ct, Cr) = mean( |slope_t - slope_r| )
+    ref_slope 为参考曲线的斜率 np.gradient(ref_curve)，在检索循环外只计算一次
     """
     # 计算斜率 (Slope)
-    s1 = np.gradient(curve1)
+    s1 = ref_slope
     s2 = np.gradient(curve2)
     
     # 计算距离 (Distance)
     # 距离越小，相似度越高
-    dist = np.mean(np.abs(s1 - s2))
+    dist = slope_dist(s1, s2)
     
     # 转换为 0-100 的相似度分数 (heuristic)
     similarity = 100 * np.exp(-10 * dist) 
@@ -257,155 +411,248 @@ def calculate_similarity(curve1, curve2):
 # ==========================================
 # 5. 相似区域检索 (Similarity Search)
 # ==========================================
-ref_smooth, ref_marks = extract_landmarks(ref_ndvi)
-if ref_smooth is None:
-    raise RuntimeError('参考区 NDVI 数据不足，无法进行相似度匹配。')
-
-results = []
-for f in sample_pts:
-    geom = ee.Geometry(f['geometry'])
-    ndvi_ts = get_ndvi_series(geom, year=2020)
-    smooth, marks = extract_landmarks(ndvi_ts)
-    if smooth is None:
-        continue
-    warped = warp_and_match(ref_smooth, smooth, ref_marks, marks)
-    sim_score, raw_dist = calculate_similarity(ref_smooth, warped)
-    if sim_score < SIM_THRESHOLD:
-        continue
-    centroid = geom.centroid(maxError=1).coordinates().getInfo()
-    results.append({
-        'geometry': f['geometry'],
-        'similarity': sim_score,
-        'distance': raw_dist,
-        'centroid': centroid,
-        'smooth': smooth,
-        'warped': warped,
-        'landmarks': marks
-    })
-
-results.sort(key=lambda x: x['similarity'], reverse=True)
-top_results = results[:TOP_N]
-
-if not top_results:
-    raise RuntimeError('未找到满足阈值的相似区域，请降低阈值或增加采样点数。')
-
-if EXPORT_CSV:
-    rows = []
-    for idx, r in enumerate(top_results, start=1):
-        rows.append({
-            'rank': idx,
-            'similarity': round(r['similarity'], 3),
-            'distance': round(r['distance'], 6),
-            'lon': r['centroid'][0],
-            'lat': r['centroid'][1]
+def search_similar(best_geom, sample_pts):
+    """
+    以参考区为金标准，对候选点做粗筛 + MICA 精匹配
+    返回 (ref_smooth, ref_marks, results)，results 按相似度降序
+    """
+    # 候选点集合：带 pid 以便批量结果回填到对应点
+    sample_fc = ee.FeatureCollection([
+        ee.Feature(ee.Geometry(f['geometry']), {'pid': i})
+        for i, f in enumerate(sample_pts)
+    ])
+
+    # 服务器端逐像元谐波拟合，参考区系数取最佳高分区均值
+    coef_img = harmonic_coefficients(year=2020)
+    ref_coefs = coef_img.reduceRegion(
+        ee.Reducer.mean(), best_geom, scale=MODIS_SCALE, bestEffort=True, tileScale=TILE_SCALE
+    )
+
+    # 参考曲线与候选粗筛互不依赖，并发发出请求
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        if USE_HARMONIC_FIT:
+            ref_future = pool.submit(get_info, ref_coefs)
+        else:
+            ref_future = pool.submit(get_ndvi_series, best_geom, 2020)
+        scores_future = pool.submit(get_harmonic_scores, coef_img, harmonic_similarity(coef_img, ref_coefs), sample_fc)
+
+        # 参考样本：谐波模式下由参考区系数重建曲线，否则使用最佳高分区的逐日 NDVI 序列
+        if USE_HARMONIC_FIT:
+            ref_coef_values = ref_future.result()
+            ref_smooth, ref_marks = extract_landmarks_harmonic([ref_coef_values.get(b) for b in HARMONIC_BANDS])
+        else:
+            ref_smooth, ref_marks = extract_landmarks(ref_future.result())
+        if ref_smooth is None:
+            raise RuntimeError('参考区 NDVI 数据不足，无法进行相似度匹配。')
+        # 参考曲线斜率在所有候选之间共享
+        ref_slope = np.gradient(ref_smooth)
+        ref_mean = ref_smooth.mean()
+
+        # 服务器端粗筛：与参考区系数比较，只有通过粗筛的候选点进入精匹配
+        harmonic_scores = scores_future.result()
+        coarse_pids = [pid for pid, (score, _) in harmonic_scores.items() if score >= COARSE_SIM_THRESHOLD]
+        print(f"服务器端粗筛: {len(coarse_pids)}/{len(sample_pts)} 个候选点进入精匹配")
+
+        if USE_HARMONIC_FIT:
+            # 每点仅 5 个系数，本地重建曲线，不再下载逐日 NDVI
+            candidates = {pid: extract_landmarks_harmonic(harmonic_scores[pid][1]) for pid in coarse_pids}
+        else:
+            sample_ndvi = {}
+            if coarse_pids:
+                sample_ndvi = get_ndvi_series_batch(sample_fc.filter(ee.Filter.inList('pid', coarse_pids)), year=2020)
+            candidates = {pid: extract_landmarks(ndvi_ts) for pid, ndvi_ts in sample_ndvi.items()}
+
+    results = []
+    for pid, (smooth, marks) in candidates.items():
+        if smooth is None:
+            continue
+        # 快速预筛：年均 NDVI 相差过大的候选 (整体长势不同) 直接跳过，省去 MICA 对齐与斜率计算
+        if 100 * np.exp(-PRUNE_K * abs(ref_mean - smooth.mean())) < SIM_THRESHOLD:
+            continue
+        warped = warp_and_match(ref_smooth, smooth, ref_marks, marks)
+        sim_score, raw_dist = calculate_similarity(ref_slope, warped)
+        if sim_score < SIM_THRESHOLD:
+            continue
+        results.append({
+            'geometry': sample_pts[pid]['geometry'],
+            'similarity': sim_score,
+            'distance': raw_dist,
+            # 候选点本身就是客户端已持有的网格中心点，坐标直接读取，无需再向 GEE 请求质心
+            'centroid': sample_pts[pid]['geometry']['coordinates'],
+            'smooth': smooth,
+            'warped': warped,
+            'landmarks': marks
         })
-    pd.DataFrame(rows).to_csv(OUTPUT_CSV, index=False)
-    print(f"✓ 相似区域结果已保存到: {OUTPUT_CSV}")
 
-if EXPORT_MAP:
-    # 地图中心设为洛川产区
-    Map = geemap.Map(center=[35.8, 109.4], zoom=10, basemap='SATELLITE')
-    
-    # 添加金标准产区（蓝色）
-    ref_fc = ee.FeatureCollection([ee.Feature(best_geom)])
-    ref_styled = ref_fc.style(**{
-        'color': '#0066ff',
-        'width': 3,
-        'fillColor': '#0066ff33'
-    })
-    Map.addLayer(ref_styled, {}, '🏆 金标准产区 (洛川)')
-    
-    # 添加相似产区（橙色点）
-    top_fc = ee.FeatureCollection([
-        ee.Feature(ee.Geometry(r['geometry']), {'similarity': r['similarity']})
-        for r in top_results
-    ])
-    styled = top_fc.style(**{
-        'color': '#ff6600',
-        'pointSize': 8,
-        'width': 2,
-        'fillColor': '#ffcc00'
-    })
-    Map.addLayer(styled, {}, f'📍 相似产区 (Top {len(top_results)})')
-    
-    Map.to_html(OUTPUT_MAP)
-    print(f"✓ 相似区域地图已保存到: {OUTPUT_MAP}")
-    print(f"  - 金标准产区: 蓝色区域")
-    print(f"  - 相似产区: 橙色点标注 (共 {len(top_results)} 个)")
-    print(f"  - 相似度范围: {top_results[-1]['similarity']:.1f}% - {top_results[0]['similarity']:.1f}%")
-
-print("\n" + "="*60)
-print("✅ 分析完成！")
-print("="*60)
-
-# 选择相似度最高的区域进行可视化对比
-best_match = top_results[0]
-tgt_smooth = best_match['smooth']
-tgt_marks = best_match['landmarks']
-warped_tgt = best_match['warped']
-sim_score = best_match['similarity']
+    results.sort(key=lambda x: x['similarity'], reverse=True)
+    return ref_smooth, ref_marks, results
 
 # ==========================================
 # 6. 结果可视化 (Visualization)
 # ==========================================
-print("\n📊 生成曲线对比图...\n")
-
-fig = plt.figure(figsize=(15, 10))
-
-# 子图1: 金标准产区 NDVI 时序
-ax1 = plt.subplot(2, 2, 1)
-ax1.plot(days, ref_smooth, 'b-', linewidth=2.5)
-ax1.fill_between(days, ref_smooth, alpha=0.2, color='blue')
-ax1.scatter(ref_marks.values(), [ref_smooth[int(i)] for i in ref_marks.values()], 
-           c='darkblue', s=80, zorder=5, marker='o')
-for name, idx in ref_marks.items():
-    ax1.annotate(name, (idx, ref_smooth[int(idx)]), 
-                xytext=(5, 5), textcoords='offset points', fontsize=9)
-ax1.set_title('🏆 金标准产区 (洛川) NDVI 时序', fontsize=12, fontweight='bold')
-ax1.set_xlabel('Day of Year (DOY)')
-ax1.set_ylabel('NDVI')
-ax1.grid(True, alpha=0.3)
-
-# 子图2: 最相似产区 NDVI 时序
-ax2 = plt.subplot(2, 2, 2)
-ax2.plot(days, tgt_smooth, 'r-', linewidth=2.5)
-ax2.fill_between(days, tgt_smooth, alpha=0.2, color='red')
-ax2.scatter(tgt_marks.values(), [tgt_smooth[int(i)] for i in tgt_marks.values()], 
-           c='darkred', s=80, zorder=5, marker='s')
-for name, idx in tgt_marks.items():
-    ax2.annotate(name, (idx, tgt_smooth[int(idx)]), 
-                xytext=(5, 5), textcoords='offset points', fontsize=9)
-ax2.set_title(f'📍 最相似产区 (相似度: {sim_score:.1f}%) NDVI 时序', fontsize=12, fontweight='bold')
-ax2.set_xlabel('Day of Year (DOY)')
-ax2.set_ylabel('NDVI')
-ax2.grid(True, alpha=0.3)
-
-# 子图3: 时间对齐前的曲线对比
-ax3 = plt.subplot(2, 2, 3)
-ax3.plot(days, ref_smooth, 'b-', label='金标准产区 (洛川)', linewidth=2.5)
-ax3.plot(days, tgt_smooth, 'r--', label='候选产区', linewidth=2.5)
-ax3.scatter(ref_marks.values(), [ref_smooth[int(i)] for i in ref_marks.values()], 
-           c='blue', s=60, zorder=5, marker='o', alpha=0.7)
-ax3.scatter(tgt_marks.values(), [tgt_smooth[int(i)] for i in tgt_marks.values()], 
-           c='red', s=60, zorder=5, marker='s', alpha=0.7)
-ax3.set_title('对齐前: 时间偏移明显', fontsize=12, fontweight='bold')
-ax3.set_xlabel('Day of Year (DOY)')
-ax3.set_ylabel('NDVI')
-ax3.legend(loc='best', fontsize=10)
-ax3.grid(True, alpha=0.3)
-
-# 子图4: 时间对齐后的曲线对比
-ax4 = plt.subplot(2, 2, 4)
-ax4.plot(days, ref_smooth, 'b-', label='金标准产区 (洛川)', linewidth=2.5)
-ax4.plot(days, warped_tgt, 'g-', label='候选产区 (对齐后)', linewidth=2.5)
-ax4.fill_between(days, ref_smooth, warped_tgt, alpha=0.1, color='gray')
-ax4.set_title(f'✅ 对齐后: 物候一致 (相似度: {sim_score:.1f}%)', fontsize=12, fontweight='bold')
-ax4.set_xlabel('Day of Year (标准化)')
-ax4.set_ylabel('NDVI')
-ax4.legend(loc='best', fontsize=10)
-ax4.grid(True, alpha=0.3)
-
-plt.tight_layout()
-plt.savefig('phenology_matching_analysis.png', dpi=150, bbox_inches='tight')
-print("✓ 曲线对比图已保存到: phenology_matching_analysis.png\n")
-plt.show()
\ No newline at end of file
+def plot_comparison(ref_smooth, ref_marks, best_match, output_png):
+    tgt_smooth = best_match['smooth']
+    tgt_marks = best_match['landmarks']
+    warped_tgt = best_match['warped']
+    sim_score = best_match['similarity']
+
+    fig = plt.figure(figsize=(15, 10))
+
+    # 关键点索引与对应 NDVI 值各只取一次，散点与标注共用
+    ref_mark_idx = np.fromiter(ref_marks.values(), dtype=int)
+    ref_mark_y = ref_smooth[ref_mark_idx]
+    tgt_mark_idx = np.fromiter(tgt_marks.values(), dtype=int)
+    tgt_mark_y = tgt_smooth[tgt_mark_idx]
+
+    # 子图1: 金标准产区 NDVI 时序
+    ax1 = plt.subplot(2, 2, 1)
+    ax1.plot(days, ref_smooth, 'b-', linewidth=2.5)
+    ax1.fill_between(days, ref_smooth, alpha=0.2, color='blue')
+    ax1.scatter(ref_mark_idx, ref_mark_y, c='darkblue', s=80, zorder=5, marker='o')
+    for name, x, y in zip(ref_marks, ref_mark_idx, ref_mark_y):
+        ax1.annotate(name, (x, y), xytext=(5, 5), textcoords='offset points', fontsize=9)
+    ax1.set_title('🏆 金标准产区 (洛川) NDVI 时序', fontsize=12, fontweight='bold')
+    ax1.set_xlabel('Day of Year (DOY)')
+    ax1.set_ylabel('NDVI')
+    ax1.grid(True, alpha=0.3)
+
+    # 子图2: 最相似产区 NDVI 时序
+    ax2 = plt.subplot(2, 2, 2)
+    ax2.plot(days, tgt_smooth, 'r-', linewidth=2.5)
+    ax2.fill_between(days, tgt_smooth, alpha=0.2, color='red')
+    ax2.scatter(tgt_mark_idx, tgt_mark_y, c='darkred', s=80, zorder=5, marker='s')
+    for name, x, y in zip(tgt_marks, tgt_mark_idx, tgt_mark_y):
+        ax2.annotate(name, (x, y), xytext=(5, 5), textcoords='offset points', fontsize=9)
+    ax2.set_title(f'📍 最相似产区 (相似度: {sim_score:.1f}%) NDVI 时序', fontsize=12, fontweight='bold')
+    ax2.set_xlabel('Day of Year (DOY)')
+    ax2.set_ylabel('NDVI')
+    ax2.grid(True, alpha=0.3)
+
+    # 子图3: 时间对齐前的曲线对比
+    ax3 = plt.subplot(2, 2, 3)
+    ax3.plot(days, ref_smooth, 'b-', label='金标准产区 (洛川)', linewidth=2.5)
+    ax3.plot(days, tgt_smooth, 'r--', label='候选产区', linewidth=2.5)
+    ax3.scatter(ref_mark_idx, ref_mark_y, c='blue', s=60, zorder=5, marker='o', alpha=0.7)
+    ax3.scatter(tgt_mark_idx, tgt_mark_y, c='red', s=60, zorder=5, marker='s', alpha=0.7)
+    ax3.set_title('对齐前: 时间偏移明显', fontsize=12, fontweight='bold')
+    ax3.set_xlabel('Day of Year (DOY)')
+    ax3.set_ylabel('NDVI')
+    ax3.legend(loc='best', fontsize=10)
+    ax3.grid(True, alpha=0.3)
+
+    # 子图4: 时间对齐后的曲线对比
+    ax4 = plt.subplot(2, 2, 4)
+    ax4.plot(days, ref_smooth, 'b-', label='金标准产区 (洛川)', linewidth=2.5)
+    ax4.plot(days, warped_tgt, 'g-', label='候选产区 (对齐后)', linewidth=2.5)
+    ax4.fill_between(days, ref_smooth, warped_tgt, alpha=0.1, color='gray')
+    ax4.set_title(f'✅ 对齐后: 物候一致 (相似度: {sim_score:.1f}%)', fontsize=12, fontweight='bold')
+    ax4.set_xlabel('Day of Year (标准化)')
+    ax4.set_ylabel('NDVI')
+    ax4.legend(loc='best', fontsize=10)
+    ax4.grid(True, alpha=0.3)
+
+    plt.tight_layout()
+    plt.savefig(output_png, dpi=150, bbox_inches='tight')
+    print(f"✓ 曲线对比图已保存到: {output_png}\n")
+    return fig
+
+# 函数：由高清 PNG 生成缩小的 WebP 缩略图 (体积通常只有 PNG 的一半左右)
+def write_thumbnail(png_path, webp_path):
+    with Image.open(png_path) as img:
+        thumb = img.convert('RGB')
+        thumb.thumbnail(THUMB_SIZE)
+        thumb.save(webp_path, 'WEBP', quality=85, method=6)
+    print(f"✓ 缩略图已保存到: {webp_path}")
+
+def run(output_dir='.', show=False):
+    """
+    完整的相似产区检索：AHP 适宜性 → 候选网格 → 粗筛 + MICA 精匹配 → 导出 CSV / 地图 / 曲线图
+    返回 {'csv': ..., 'map': ..., 'png': ..., 'webp': ...}，未导出的项为 None
+    """
+    initialize()
+    # 复用 AHP 模块的适宜性图层和 ROI
+    roi, final = AHP.build_suitability()
+
+    print("\n" + "="*60)
+    print("富士苹果相似产区智能检索系统")
+    print("="*60)
+    print("金标准产区: 陕西洛川 (109.4°E, 35.8°N)")
+    print("搜索范围: 50km 半径周边地区")
+    print("目标: 找到与洛川生态条件接近的潜在优质地块")
+    print("="*60 + "\n")
+
+    best_geom, sample_pts = find_candidates(roi, final)
+    ref_smooth, ref_marks, results = search_similar(best_geom, sample_pts)
+    top_results = results[:TOP_N]
+
+    if not top_results:
+        raise RuntimeError('未找到满足阈值的相似区域，请降低阈值或增加采样点数。')
+
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = {
+        'csv': None, 'map': None,
+        'png': os.path.join(output_dir, OUTPUT_PNG), 'webp': os.path.join(output_dir, OUTPUT_WEBP)
+    }
+
+    if EXPORT_CSV:
+        outputs['csv'] = os.path.join(output_dir, OUTPUT_CSV)
+        # 流式逐行写出，不构造中间 dict 列表与 DataFrame
+        with open(outputs['csv'], 'w', newline='', encoding='utf-8') as fh:
+            writer = csv.writer(fh)
+            writer.writerow(('rank', 'similarity', 'distance', 'lon', 'lat'))
+            writer.writerows(
+                (idx, round(float(r['similarity']), 3), round(float(r['distance']), 6), r['centroid'][0], r['centroid'][1])
+                for idx, r in enumerate(top_results, start=1)
+            )
+        print(f"✓ 相似区域结果已保存到: {outputs['csv']}")
+
+    if EXPORT_MAP:
+        # 地图中心设为洛川产区
+        Map = geemap.Map(center=[35.8, 109.4], zoom=10, basemap='SATELLITE')
+
+        # 添加金标准产区（蓝色）
+        ref_fc = ee.FeatureCollection([ee.Feature(best_geom)])
+        ref_styled = ref_fc.style(**{
+            'color': '#0066ff',
+            'width': 3,
+            'fillColor': '#0066ff33'
+        })
+        Map.addLayer(ref_styled, {}, '🏆 金标准产区 (洛川)')
+
+        # 添加相似产区（橙色点）
+        top_fc = ee.FeatureCollection([
+            ee.Feature(ee.Geometry(r['geometry']), {'similarity': r['similarity']})
+            for r in top_results
+        ])
+        styled = top_fc.style(**{
+            'color': '#ff6600',
+            'pointSize': 8,
+            'width': 2,
+            'fillColor': '#ffcc00'
+        })
+        Map.addLayer(styled, {}, f'📍 相似产区 (Top {len(top_results)})')
+
+        outputs['map'] = os.path.join(output_dir, OUTPUT_MAP)
+        Map.to_html(outputs['map'])
+        print(f"✓ 相似区域地图已保存到: {outputs['map']}")
+        print(f"  - 金标准产区: 蓝色区域")
+        print(f"  - 相似产区: 橙色点标注 (共 {len(top_results)} 个)")
+        print(f"  - 相似度范围: {top_results[-1]['similarity']:.1f}% - {top_results[0]['similarity']:.1f}%")
+
+    print("\n" + "="*60)
+    print("✅ 分析完成！")
+    print("="*60)
+
+    # 选择相似度最高的区域进行可视化对比
+    print("\n📊 生成曲线对比图...\n")
+    fig = plot_comparison(ref_smooth, ref_marks, top_results[0], outputs['png'])
+    write_thumbnail(outputs['png'], outputs['webp'])
+    if show:
+        plt.show()
+    # 被 app 反复调用时及时释放图像，避免 matplotlib 图像堆积
+    plt.close(fig)
+
+    return outputs
+
+if __name__ == '__main__':
+    run(show=True)
@@ -0,0 +1,95 @@
+"""
+物候匹配的数值内核：斜率距离与峰值检测
+
+安装了 numba 时使用 @njit(cache=True) 编译的单循环实现；
+未安装时回退到等价的 NumPy / SciPy 实现，结果一致 (仅等高峰值的取舍顺序可能不同)。
+"""
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # numba 为可选依赖
+    njit = None
+
+
+if njit is not None:
+    @njit(cache=True)
+    def slope_dist(a, b):
+        """
+        mean(|a - b|)，一次遍历完成，不生成 a-b 与 abs 临时数组
+        """
+        acc = 0.0
+        for i in range(a.size):
+            acc += abs(a[i] - b[i])
+        return acc / a.size
+
+    @njit(cache=True)
+    def _find_peaks(x, height, distance):
+        n = x.size
+        # a. 局部极大值 (平台取中点，与 scipy.signal.find_peaks 一致)
+        peaks = np.empty(n // 2 + 1, dtype=np.int64)
+        m = 0
+        i = 1
+        while i < n - 1:
+            if x[i - 1] < x[i]:
+                j = i + 1
+                while j < n - 1 and x[j] == x[i]:
+                    j += 1
+                if x[j] < x[i]:
+                    peak = (i + j - 1) // 2
+                    # b. 高度过滤
+                    if x[peak] >= height:
+                        peaks[m] = peak
+                        m += 1
+                i = j
+            else:
+                i += 1
+        peaks = peaks[:m]
+
+        # c. 最小间距过滤：从最高峰开始，剔除其 distance 范围内的较低峰
+        keep = np.ones(m, dtype=np.bool_)
+        order = np.argsort(x[peaks])
+        for r in range(m - 1, -1, -1):
+            k = order[r]
+            if not keep[k]:
+                continue
+            p = k - 1
+            while p >= 0 and peaks[k] - peaks[p] < distance:
+                keep[p] = False
+                p -= 1
+            p = k + 1
+            while p < m and peaks[p] - peaks[k] < distance:
+                keep[p] = False
+                p += 1
+        return peaks[keep]
+
+    def find_peaks(x, height, distance):
+        """
+        scipy.signal.find_peaks(x, height=height, distance=distance)[0] 的编译版本
+        """
+        return _find_peaks(np.ascontiguousarray(x, dtype=np.float64), float(height), int(np.ceil(distance)))
+
+else:
+    from scipy.signal import find_peaks as _scipy_find_peaks
+
+    def slope_dist(a, b):
+        """
+        mean(|a - b|)
+        """
+        return float(np.mean(np.abs(a - b)))
+
+    def find_peaks(x, height, distance):
+        """
+        返回满足高度与最小间距条件的峰值索引
+        """
+        return _scipy_find_peaks(x, height=height, distance=distance)[0]
+
+
+def warmup():
+    """
+    用小数组调用一次各内核，触发 numba 编译 (或从 cache=True 的磁盘缓存加载)，
+    避免首次匹配时付出编译延迟；未安装 numba 时为空操作
+    """
+    x = np.sin(np.linspace(0.0, 6.0, 64))
+    slope_dist(x, x)
+    find_peaks(x, 0.0, 1)
@@ -2,9 +2,14 @@ import streamlit as st
 import streamlit.components.v1 as components
 import pandas as pd
 import numpy as np
-import pydeck as pdk
+import base64
+import hashlib
+import io
+import os
+import json
 import time
-import runpy
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # --- 页面配置 (必须在第一行) ---
@@ -16,161 +21,238 @@ st.set_page_config(
 )
 
 ROOT_DIR = Path(__file__).resolve().parent
-OUTPUT_SUITABILITY_MAP = ROOT_DIR / "suitability_map.html"
-OUTPUT_SIMILARITY_MAP = ROOT_DIR / "similar_regions_map.html"
-OUTPUT_SIMILARITY_CSV = ROOT_DIR / "similar_regions.csv"
-OUTPUT_PHENOLOGY_PNG = ROOT_DIR / "phenology_matching_analysis.png"
+# numba 的 cache=True 编译产物固定存放于项目目录，进程重启后直接加载，不再重新编译
+# (须在首次导入 numba 之前设置)
+os.environ.setdefault("NUMBA_CACHE_DIR", str(ROOT_DIR / ".numba_cache"))
+# 需在 .streamlit/config.toml 中开启 server.enableStaticServing，页面通过 app/static/ 访问
+STATIC_DIR = ROOT_DIR / "static"
+# 分析输出放在静态目录下，PNG 等白名单类型可由浏览器直接按 URL 加载
+# (Streamlit 静态服务对 .html 一律返回 text/plain，地图仍需经 components.html 嵌入)
+OUTPUT_ROOT = STATIC_DIR / "outputs"
 
 
-def run_ahp_analysis():
-    runpy.run_path(str(ROOT_DIR / "AHP.py"), run_name="__main__")
+@st.cache_resource
+def load_hybrid_module():
+    # 文件名含空格，无法直接 import，按路径加载一次后复用
+    spec = importlib.util.spec_from_file_location("hybrid_phenology_matching", ROOT_DIR / "Hybrid Phenology Matching.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    # 模块加载时顺带预热物候匹配内核，首次运行不再承担 JIT 编译
+    import _sim
+    _sim.warmup()
+    return module
 
 
-def run_hybrid_matching():
-    runpy.run_path(str(ROOT_DIR / "Hybrid Phenology Matching.py"), run_name="__main__")
+def output_dir_for(province, city):
+    # 输出目录名嵌入输入参数的哈希，同一组输入跨会话复用磁盘结果
+    key = hashlib.sha1(f"{province}|{city}".encode("utf-8")).hexdigest()[:12]
+    return OUTPUT_ROOT / key
 
 
-if "ahp_done" not in st.session_state:
-    st.session_state.ahp_done = False
-if "hybrid_done" not in st.session_state:
-    st.session_state.hybrid_done = False
+@st.cache_data(show_spinner=False, ttl=3600)
+def cached_ahp(province, city):
+    # ee / geemap 较重，只在真正运行分析时才导入
+    from AHP import run as ahp_run
+    outputs = ahp_run(output_dir=str(output_dir_for(province, city)))
+    return {name: str(path) for name, path in outputs.items() if path}
 
-# --- 自定义CSS (整体视觉与模块组件) ---
-st.markdown("""
-<style>
-@import url('https://fonts.googleapis.com/css2?family=Space+Grotesk:wght@400;500;600;700&family=ZCOOL+XiaoWei&display=swap');
-
-:root {
-    --bg-0: #0b0f14;
-    --bg-1: #0f1720;
-    --bg-2: #121c28;
-    --glow-1: #61d9ff;
-    --glow-2: #7cffc4;
-    --accent: #f7d774;
-    --text-0: #e9f0f7;
-    --text-1: #a4b3c6;
-    --card: rgba(20, 30, 40, 0.62);
-    --stroke: rgba(136, 176, 206, 0.25);
-}
 
-* { font-family: 'Space Grotesk', 'ZCOOL XiaoWei', sans-serif; }
+@st.cache_data(show_spinner=False, ttl=3600)
+def cached_hybrid(province, city):
+    outputs = load_hybrid_module().run(output_dir=str(output_dir_for(province, city)))
+    return {name: str(path) for name, path in outputs.items() if path}
 
-.stApp {
-    background: radial-gradient(1200px 600px at 10% 10%, rgba(97, 217, 255, 0.08), transparent 60%),
-                radial-gradient(900px 500px at 90% 20%, rgba(124, 255, 196, 0.08), transparent 60%),
-                linear-gradient(160deg, var(--bg-0), var(--bg-1) 55%, var(--bg-2));
-    color: var(--text-0);
-}
 
-section.main > div { padding-top: 1.2rem; }
+def static_url(path):
+    # static/ 下文件的页面内 URL；?v=mtime 在文件重新生成后绕过浏览器缓存
+    return f"app/static/{path.relative_to(STATIC_DIR).as_posix()}?v={int(path.stat().st_mtime)}"
 
-.hero {
-    border: 1px solid var(--stroke);
-    border-radius: 24px;
-    padding: 28px 32px;
-    background: linear-gradient(120deg, rgba(16, 25, 36, 0.85), rgba(12, 20, 28, 0.72));
-    box-shadow: 0 24px 60px rgba(0,0,0,0.35);
-}
 
-.hero h1 {
-    font-family: 'ZCOOL XiaoWei', serif;
-    letter-spacing: 1px;
-    font-size: 40px;
-    margin-bottom: 0.3rem;
-}
+@st.cache_data
+def _read_html(path, mtime):
+    # mtime 参与缓存键：文件重新生成后自动失效
+    return Path(path).read_text(encoding="utf-8")
 
-.hero p { color: var(--text-1); font-size: 16px; }
-
-.badge {
-    display: inline-flex;
-    gap: 10px;
-    align-items: center;
-    padding: 6px 12px;
-    border-radius: 999px;
-    border: 1px solid var(--stroke);
-    background: rgba(15, 30, 40, 0.5);
-    color: var(--text-1);
-    font-size: 12px;
-}
 
-.stat-grid {
-    display: grid;
-    grid-template-columns: repeat(4, minmax(0, 1fr));
-    gap: 14px;
-    margin-top: 18px;
-}
+# 相似产区排名表中展示的列 (与 Hybrid Phenology Matching.py 写出的表头一致)
+SIMILARITY_COLUMNS = ["rank", "similarity", "distance", "lon", "lat"]
 
-.stat {
-    background: var(--card);
-    border: 1px solid var(--stroke);
-    border-radius: 18px;
-    padding: 14px 16px;
-}
 
-.stat h3 { font-size: 20px; margin: 0 0 6px; }
-.stat span { color: var(--text-1); font-size: 12px; }
+@st.cache_data
+def _read_csv(path, mtime):
+    # mtime 参与缓存键：文件重新生成后自动失效
+    # pyarrow 原生解析并只读取展示列；st.dataframe 直接接受 Arrow 表，省去 pandas 中转
+    import pyarrow.csv as pacsv
+    return pacsv.read_csv(
+        path,
+        read_options=pacsv.ReadOptions(block_size=1 << 20),
+        convert_options=pacsv.ConvertOptions(include_columns=SIMILARITY_COLUMNS),
+    )
 
-.panel {
-    background: var(--card);
-    border: 1px solid var(--stroke);
-    border-radius: 20px;
-    padding: 18px 20px;
-}
 
-.section-title {
-    display: flex;
-    align-items: center;
-    gap: 8px;
-    font-weight: 600;
-    font-size: 18px;
-    margin-bottom: 10px;
-}
+@st.cache_data
+def _read_bytes(path, mtime):
+    return Path(path).read_bytes()
 
-.glow {
-    color: var(--glow-2);
-    text-shadow: 0 0 12px rgba(124, 255, 196, 0.35);
-}
 
-.big-font {
-    font-size: 30px !important;
-    font-weight: 700;
-    color: var(--accent);
-}
+@st.cache_data
+def make_demo_points(n=1000, center=(33.6, 109.0), seed=0):
+    # 生成模拟数据 (在陕西附近的坐标)，固定随机种子保证每次重跑数据一致
+    # 这里的 lat/lon 是模拟商洛山区的
+    rng = np.random.default_rng(seed)
+    # 一次分配 (n, 3) 数组：前两列为坐标，第三列“潜力值”用于热力图权重
+    arr = rng.standard_normal((n, 3))
+    arr[:, :2] = arr[:, :2] / 50 + center
+    arr[:, 2] = rng.random(n)
+    # 演示数据无需双精度，float32 内存减半
+    return pd.DataFrame(arr.astype(np.float32), columns=["lat", "lon", "potential"])
+
+
+@st.cache_resource
+def publish_points(df_map, name):
+    # 点数据写入 static/ 由 Streamlit 静态服务提供，图层只传 URL，deck.gl 直接拉取并解析，
+    # 不再经 pydeck 的 JSON 序列化和 websocket 推送；只保留图层用到的列
+    # JSON 按文本序列化，float32 装箱后位数反而更长；先舍入 (经纬度 5 位 ≈ 1 m)，才真正缩小文件体积
+    cols = df_map[["lon", "lat", "potential"]].astype("float64").round({"lon": 5, "lat": 5, "potential": 3})
+    features = [
+        {"type": "Feature", "geometry": {"type": "Point", "coordinates": [lon, lat]}, "properties": {"potential": p}}
+        for lon, lat, p in cols.itertuples(index=False)
+    ]
+    STATIC_DIR.mkdir(exist_ok=True)
+    # deck.gl 的非 GeoJsonLayer 需要可迭代数据，因此写 Feature 数组而不是 FeatureCollection
+    (STATIC_DIR / f"{name}.json").write_text(json.dumps(features, separators=(",", ":")), encoding="utf-8")
+    return f"app/static/{name}.json"
+
+
+# 点数达到该值时改为服务器端预聚合的栅格 (BitmapLayer)，避免 HeatmapLayer 逐点核密度拖慢前端
+HEATMAP_POINT_LIMIT = 2000
+HEATMAP_BINS = 256
+
+
+def encode_png(grid):
+    # 加权计数网格 → 黄到红渐变的半透明 PNG (data URL)，空网格完全透明
+    from PIL import Image
+    norm = grid / grid.max() if grid.max() > 0 else grid
+    rgba = np.zeros(grid.shape + (4,), dtype=np.uint8)
+    rgba[..., 0] = 255
+    rgba[..., 1] = (220 * (1 - norm)).astype(np.uint8)
+    rgba[..., 3] = (255 * np.sqrt(norm)).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(rgba, "RGBA").save(buf, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+@st.cache_resource
+def make_layer(df_map, name="heatmap"):
+    import pydeck as pdk
+    if len(df_map) >= HEATMAP_POINT_LIMIT:
+        counts, xe, ye = np.histogram2d(df_map.lon, df_map.lat, bins=HEATMAP_BINS, weights=df_map.potential)
+        # histogram2d 的第一维是经度；图像行需自北向南排列
+        return pdk.Layer(
+            "BitmapLayer",
+            image=encode_png(counts.T[::-1]),
+            bounds=[xe[0], ye[0], xe[-1], ye[-1]],
+            opacity=0.8,
+        )
+    return pdk.Layer(
+        "HeatmapLayer",
+        data=publish_points(df_map, name),
+        get_position="geometry.coordinates",
+        get_weight="properties.potential",
+        radius_pixels=60,
+        opacity=0.8,
+    )
 
-.stSidebar {
-    background: linear-gradient(180deg, rgba(10, 18, 26, 0.98), rgba(9, 14, 20, 0.92));
-    border-right: 1px solid rgba(136, 176, 206, 0.18);
-}
 
-.stSidebar .stRadio > label, .stSidebar .stSelectbox > label {
-    color: var(--text-1);
-}
+@st.cache_data
+def iot_24h():
+    # 模拟过去 24 小时的温度和湿度，固定随机种子，重跑时图表数据不变
+    rng = np.random.default_rng(7)
+    return pd.DataFrame(rng.standard_normal((24, 2)) + [18, 45], columns=['温度 (°C)', '湿度 (%)'])
 
-.stTabs [data-baseweb="tab"] {
-    background: rgba(16, 26, 36, 0.55);
-    border: 1px solid var(--stroke);
-    border-radius: 999px;
-    color: var(--text-1);
-    padding: 8px 16px;
-}
 
-.stTabs [data-baseweb="tab"][aria-selected="true"] {
-    color: var(--text-0);
-    border-color: rgba(124, 255, 196, 0.5);
-    box-shadow: 0 0 16px rgba(97, 217, 255, 0.2);
+# 热力图数据集：data_key → make_demo_points 参数
+DEMO_DATASETS = {
+    "demo_v1": {"n": 1000, "center": (33.6, 109.0), "seed": 0},
 }
 
-@media (max-width: 980px) {
-    .stat-grid { grid-template-columns: repeat(2, minmax(0, 1fr)); }
-}
 
-@media (max-width: 640px) {
-    .stat-grid { grid-template-columns: 1fr; }
-    .hero { padding: 22px; }
-    .hero h1 { font-size: 30px; }
-}
-</style>
-""", unsafe_allow_html=True)
+@st.cache_resource
+def build_deck(lat, lon, zoom, data_key):
+    # pydeck 只有卫星扫描模式用到，在首次构建时才导入，缩短其他模式的冷启动
+    import pydeck as pdk
+    layer = make_layer(make_demo_points(**DEMO_DATASETS[data_key]))
+    return pdk.Deck(
+        layers=[layer],
+        initial_view_state=pdk.ViewState(latitude=lat, longitude=lon, zoom=zoom, pitch=50),
+        tooltip={"text": "风土匹配度: {potential}"}
+    )
+
+
+@st.cache_resource
+def job_pool():
+    # 进程内共享的后台线程池：AHP / 物候匹配在此运行，脚本线程不被阻塞
+    return ThreadPoolExecutor(max_workers=2)
+
+
+def start_job(name, fn, *args):
+    if f"{name}_future" not in st.session_state:
+        st.session_state[f"{name}_future"] = job_pool().submit(fn, *args)
+
+
+@st.fragment(run_every=1)
+def _watch_job(name, running_msg):
+    # 只有该片段每秒重跑；任务结束后触发整页重跑以展示结果
+    fut = st.session_state.get(f"{name}_future")
+    if fut is None or fut.done():
+        st.rerun()
+    st.info(running_msg)
+
+
+def job_status(name, running_msg, done_msg, fail_msg):
+    fut = st.session_state.get(f"{name}_future")
+    if fut is None:
+        return
+    if not fut.done():
+        _watch_job(name, running_msg)
+        return
+    del st.session_state[f"{name}_future"]
+    exc = fut.exception()
+    if exc is None:
+        st.success(done_msg)
+    else:
+        st.error(f"{fail_msg}: {exc}")
+
+
+# 各分析输出依赖的源码：输出早于任一源码即视为过期，需要重新计算
+AHP_SOURCES = [ROOT_DIR / "AHP.py"]
+HYBRID_SOURCES = AHP_SOURCES + [ROOT_DIR / "Hybrid Phenology Matching.py", ROOT_DIR / "_sim.py"]
+
+
+def is_stale(output, sources):
+    return not output.exists() or output.stat().st_mtime < max(src.stat().st_mtime for src in sources)
+
+# --- 自定义CSS (整体视觉与模块组件) ---
+# 样式表放在 styles.css，文件只读一次；Streamlit 每次重跑都会重建页面元素，所以 <style> 仍需每次输出
+# 字体改用 stylesheet 链接代替 @import；st.markdown 的内容在页面骨架渲染后才插入，不会阻塞首屏
+# (React 不执行字符串形式的 onload，不能用 media="print" 切换技巧，否则字体永远不生效)
+FONTS_URL = "https://fonts.googleapis.com/css2?family=Space+Grotesk:wght@400;500;600;700&family=ZCOOL+XiaoWei&display=swap"
+
+
+@st.cache_resource
+def _css():
+    css = (ROOT_DIR / "styles.css").read_text(encoding="utf-8")
+    # preconnect / preload 让字体 CSS 与应用样式并行获取；紧随其后的普通 stylesheet 链接直接复用预加载结果
+    return (
+        '<link rel="preconnect" href="https://fonts.googleapis.com">'
+        '<link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>'
+        f'<link rel="preload" as="style" href="{FONTS_URL}">'
+        f'<link rel="stylesheet" href="{FONTS_URL}">'
+        f"<style>\n{css}</style>"
+    )
+
+
+st.markdown(_css(), unsafe_allow_html=True)
 
 # --- 侧边栏：控制台 ---
 st.sidebar.image("https://img.icons8.com/color/96/000000/satellite-sending-signal.png", width=80)
@@ -187,6 +269,17 @@ scan_mode = st.sidebar.radio("扫描模式", ["广域光谱初筛 (卫星)", "
 
 st.sidebar.info("当前连接卫星：Sentinel-2L\n数据延迟：< 10ms")
 
+# 演示模式下扫描阶段之间稍作停顿，便于观看；默认关闭，不阻塞会话线程
+DEMO = st.sidebar.checkbox("演示模式", False)
+
+# 当前输入对应的输出文件
+output_dir = output_dir_for(target_province, target_city)
+OUTPUT_SUITABILITY_MAP = output_dir / "suitability_map.html"
+OUTPUT_SIMILARITY_MAP = output_dir / "similar_regions_map.html"
+OUTPUT_SIMILARITY_CSV = output_dir / "similar_regions.csv"
+OUTPUT_PHENOLOGY_PNG = output_dir / "phenology_matching_analysis.png"
+OUTPUT_PHENOLOGY_WEBP = output_dir / "phenology_matching_analysis.webp"
+
 # --- 主界面逻辑 ---
 
 # 头部视觉区
@@ -198,14 +291,12 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-st.markdown("""
-<div class="stat-grid">
-    <div class="stat"><h3>92%</h3><span>风土匹配度峰值</span></div>
-    <div class="stat"><h3>1.2k</h3><span>卫星样本像元</span></div>
-    <div class="stat"><h3>24h</h3><span>微气候监测窗口</span></div>
-    <div class="stat"><h3>40x</h3><span>亩产值提升潜力</span></div>
-</div>
-""", unsafe_allow_html=True)
+# 核心指标使用原生 st.metric，前端按组件增量更新，不再每次重新解析整段 HTML
+c1, c2, c3, c4 = st.columns(4)
+c1.metric("风土匹配度峰值", "92%")
+c2.metric("卫星样本像元", "1.2k")
+c3.metric("微气候监测窗口", "24h")
+c4.metric("亩产值提升潜力", "40x")
 
 st.markdown(f"<div class='section-title'>🌍 {target_city} · <span class='glow'>农业风土价值发现报告</span></div>", unsafe_allow_html=True)
 st.markdown(f"系统正在分析 {target_province} 秦巴山区腹地数据，输出从遥感到商业价值的全链路评估。")
@@ -218,46 +309,20 @@ if scan_mode == "广域光谱初筛 (卫星)":
     st.markdown("<div class='panel'>", unsafe_allow_html=True)
     st.markdown("<div class='section-title'>1. 卫星光谱遥感扫描</div>", unsafe_allow_html=True)
     
-    # 模拟一个进度条，增加演示时的紧张感
+    # 扫描阶段提示：4 个阶段各更新一次进度条 (仅演示模式下 sleep)
     if st.button("🚀 启动全域扫描"):
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        for i in range(100):
-            # 模拟不同的计算阶段
-            if i < 30: status_text.text("正在加载多光谱影像...")
-            elif i < 60: status_text.text("正在计算 NDVI 植被指数...")
-            elif i < 90: status_text.text("正在匹配‘波尔多’风土模型...")
-            else: status_text.text("正在生成热力图...")
-            time.sleep(0.02) # 演示速度
-            progress_bar.progress(i + 1)
+        with st.status("正在扫描...", expanded=True) as status:
+            progress_bar = st.progress(0)
+            status_text = st.empty()
+            for pct, msg in [(30, "正在加载多光谱影像..."), (60, "正在计算 NDVI 植被指数..."), (90, "正在匹配‘波尔多’风土模型..."), (100, "正在生成热力图...")]:
+                status_text.text(msg)
+                progress_bar.progress(pct)
+                time.sleep(0.05 if DEMO else 0)
+            status.update(label="扫描完成", state="complete", expanded=False)
         st.success("扫描完成！发现 3 块高潜力未开发地块。")
 
-    # 生成模拟数据 (在陕西附近的坐标)
-    # 这里的 lat/lon 是模拟商洛山区的
-    df_map = pd.DataFrame(
-        np.random.randn(1000, 2) / [50, 50] + [33.6, 109.0],
-        columns=['lat', 'lon'])
-    
-    # 增加一列“潜力值”，用于热力图权重
-    df_map['potential'] = np.random.rand(1000)
-
-    # 使用 Pydeck 绘制酷炫的 3D 热力图
-    layer = pdk.Layer(
-        "HeatmapLayer",
-        data=df_map,
-        get_position='[lon, lat]',
-        get_weight="potential",
-        radius_pixels=60,
-        opacity=0.8,
-    )
-
-    view_state = pdk.ViewState(latitude=33.6, longitude=109.0, zoom=10, pitch=50)
-    
-    st.pydeck_chart(pdk.Deck(
-        layers=[layer],
-        initial_view_state=view_state,
-        tooltip={"text": "风土匹配度: {potential}"}
-    ))
+    # 使用 Pydeck 绘制酷炫的 3D 热力图 (Deck 对象整体缓存，重跑时不再重建)
+    st.pydeck_chart(build_deck(33.6, 109.0, 10, "demo_v1"))
 
     st.caption("🔴 红色高亮区域：风土模型匹配度 > 95% (建议重点开发)")
     st.markdown("</div>", unsafe_allow_html=True)
@@ -266,16 +331,17 @@ if scan_mode == "广域光谱初筛 (卫星)":
     st.markdown("<div class='section-title'>1.1 AHP 适宜性分析 (真实计算)</div>", unsafe_allow_html=True)
     st.write("运行后会生成适宜性地图并在此处展示。")
     if st.button("🧭 运行 AHP 适宜性分析"):
-        with st.spinner("正在计算适宜性指数，请稍候..."):
-            try:
-                run_ahp_analysis()
-                st.session_state.ahp_done = True
-                st.success("AHP 适宜性分析完成。")
-            except Exception as exc:
-                st.error(f"AHP 计算失败: {exc}")
-
-    if st.session_state.ahp_done and OUTPUT_SUITABILITY_MAP.exists():
-        components.html(OUTPUT_SUITABILITY_MAP.read_text(encoding="utf-8"), height=560, scrolling=True)
+        if is_stale(OUTPUT_SUITABILITY_MAP, AHP_SOURCES):
+            # 磁盘输出缺失或过期时，内存中的缓存结果同样失效
+            cached_ahp.clear()
+            start_job("ahp", cached_ahp, target_province, target_city)
+        else:
+            st.info("适宜性地图已是最新，无需重新计算。")
+    job_status("ahp", "正在计算适宜性指数，可继续浏览其他模块...", "AHP 适宜性分析完成。", "AHP 计算失败")
+
+    # 结果直接以磁盘文件为准，刷新页面或新会话同样可见
+    if OUTPUT_SUITABILITY_MAP.exists():
+        components.html(_read_html(str(OUTPUT_SUITABILITY_MAP), OUTPUT_SUITABILITY_MAP.stat().st_mtime), height=560, scrolling=True)
         st.caption("🗺️ 适宜性地图已生成：高分区建议重点开发。")
     st.markdown("</div>", unsafe_allow_html=True)
 
@@ -301,11 +367,7 @@ elif scan_mode == "精准小气候分析 (IoT)":
     # 模拟实时数据图表
     st.subheader("📊 过去 24 小时微气候变化趋势")
     
-    chart_data = pd.DataFrame(
-        np.random.randn(24, 2) + [18, 45], # 模拟温度和湿度
-        columns=['温度 (°C)', '湿度 (%)']
-    )
-    st.line_chart(chart_data)
+    st.line_chart(iot_24h())
     
     st.info("💡 结论：该地块昼夜温差大，非常有利于苹果/葡萄的糖分与花青素积累。")
     st.markdown("</div>", unsafe_allow_html=True)
@@ -350,21 +412,23 @@ elif scan_mode == "资产价值评估 (AI)":
     st.markdown("<div class='section-title'>3.1 物候匹配与相似产区检索 (真实计算)</div>", unsafe_allow_html=True)
     st.write("运行后会生成相似产区地图、CSV 排名和对比图。")
     if st.button("🧪 运行物候匹配"):
-        with st.spinner("正在进行物候匹配与相似区域检索..."):
-            try:
-                run_hybrid_matching()
-                st.session_state.hybrid_done = True
-                st.success("物候匹配完成。")
-            except Exception as exc:
-                st.error(f"物候匹配失败: {exc}")
-
-    if st.session_state.hybrid_done:
-        if OUTPUT_SIMILARITY_MAP.exists():
-            components.html(OUTPUT_SIMILARITY_MAP.read_text(encoding="utf-8"), height=560, scrolling=True)
-        if OUTPUT_SIMILARITY_CSV.exists():
-            st.subheader("📋 相似产区排名")
-            st.dataframe(pd.read_csv(OUTPUT_SIMILARITY_CSV))
+        if is_stale(OUTPUT_SIMILARITY_CSV, HYBRID_SOURCES):
+            cached_hybrid.clear()
+            start_job("hybrid", cached_hybrid, target_province, target_city)
+        else:
+            st.info("物候匹配结果已是最新，无需重新计算。")
+    job_status("hybrid", "正在进行物候匹配与相似区域检索，可继续浏览其他模块...", "物候匹配完成。", "物候匹配失败")
+
+    # 结果直接以磁盘文件为准，刷新页面或新会话同样可见
+    if OUTPUT_SIMILARITY_MAP.exists():
+        components.html(_read_html(str(OUTPUT_SIMILARITY_MAP), OUTPUT_SIMILARITY_MAP.stat().st_mtime), height=560, scrolling=True)
+    if OUTPUT_SIMILARITY_CSV.exists():
+        st.subheader("📋 相似产区排名")
+        st.dataframe(_read_csv(str(OUTPUT_SIMILARITY_CSV), OUTPUT_SIMILARITY_CSV.stat().st_mtime), use_container_width=True)
+    if OUTPUT_PHENOLOGY_WEBP.exists():
+        st.subheader("📈 物候曲线对比")
+        # 页面只展示 WebP 缩略图，高清 PNG 经静态地址按需下载
+        st.image(_read_bytes(str(OUTPUT_PHENOLOGY_WEBP), OUTPUT_PHENOLOGY_WEBP.stat().st_mtime))
         if OUTPUT_PHENOLOGY_PNG.exists():
-            st.subheader("📈 物候曲线对比")
-            st.image(str(OUTPUT_PHENOLOGY_PNG), use_container_width=True)
+            st.markdown(f"[📥 下载高清]({static_url(OUTPUT_PHENOLOGY_PNG)})")
     st.markdown("</div>", unsafe_allow_html=True)
\ No newline at end of file